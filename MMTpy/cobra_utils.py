@@ -1,9 +1,16 @@
 import os
+import pickle
 import sys
 from math import isnan
 
 import cobra
 import pandas as pd
+from cobra.io.json import JSON_SPEC
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from match_names_to_vmh import match_names_to_vmh
 
@@ -41,6 +48,16 @@ def print_logo(tool: str, tool_description: str, version: str):
     print(output)
 
 
+# Model readers by file extension; COBRApy raises on missing files itself
+_MODEL_LOADERS = {
+    ".xml": cobra.io.read_sbml_model,
+    ".sbml": cobra.io.read_sbml_model,
+    ".json": cobra.io.load_json_model,
+    ".yml": cobra.io.load_yaml_model,
+    ".mat": cobra.io.load_matlab_model,
+}
+
+
 def load_model(model_path: str) -> cobra.Model:
     """
     Load a multi-species model into memory given a path to a model file in a
@@ -58,37 +75,79 @@ def load_model(model_path: str) -> cobra.Model:
 
     Raises
     ------
-    ValueError
-        If the model_path does not exist.
     ValueError
         If the model format is not supported.
+
+    Notes
+    -----
+    A pickled copy of the model is cached next to the model file on first
+    load; subsequent loads read the pickle instead of re-parsing the source
+    file and rebuilding the solver problem.
     """
 
-    if not os.path.exists(model_path):
-        raise ValueError(f"Model path does not exist: {model_path}")
+    loader = _MODEL_LOADERS.get(os.path.splitext(model_path)[1].lower())
+    if loader is None:
+        raise ValueError(f"Model format not supported for {model_path}")
 
     print(f"\n[START] Loading model from {model_path}...")
 
-    if model_path.endswith(".xml"):
-        model = cobra.io.read_sbml_model(model_path)
-    elif model_path.endswith(".json"):
-        model = cobra.io.load_json_model(model_path)
-    elif model_path.endswith(".yml"):
-        model = cobra.io.load_yaml_model(model_path)
-    elif model_path.endswith(".mat"):
-        model = cobra.io.load_matlab_model(model_path)
-    elif model_path.endswith(".sbml"):
-        model = cobra.io.read_sbml_model(model_path)
-    else:
-        raise ValueError(f"Model format not supported for {model_path}")
+    # Load the cached pickle if it is at least as new as the model file; a
+    # stale cache without its source file falls through to the loader, which
+    # raises its usual error for the missing file
+    cache_path = model_path + ".pkl"
+    if (
+        os.path.exists(cache_path)
+        and os.path.exists(model_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(model_path)
+    ):
+        with open(cache_path, "rb") as cache_file:
+            model = pickle.load(cache_file)
+
+        print(f"\n[DONE] {model.name} loaded from cache.")
+
+        return model
+
+    model = loader(model_path)
 
-    model.name = os.path.basename(model_path).split(".")[0]
+    model.name = os.path.splitext(os.path.basename(model_path))[0]
+
+    # Cache the parsed model so later loads can skip the parsing step
+    with open(cache_path, "wb") as cache_file:
+        pickle.dump(model, cache_file)
 
     print(f"\n[DONE] {model.name} loaded.")
 
     return model
 
 
+def _default_bounds_for(rxn_id: str) -> tuple or None:
+    """
+    Classify a reaction ID into its default bounds convention in a single
+    scan of the ID; returns None for reactions without a default convention.
+
+    Parameters
+    ----------
+    rxn_id : str
+        The ID of the reaction to classify.
+
+    Returns
+    -------
+    tuple or None
+        The default bounds for the reaction, or None if it has none.
+    """
+    if rxn_id.startswith("EX_") and rxn_id.endswith("[fe]"):
+        if "microbeBiomass" in rxn_id:
+            return (-10000.0, 1000000.0)
+        return (-1000.0, 1000000.0)
+    if rxn_id.startswith("UFEt_") or rxn_id.startswith("DUt_"):
+        return (0.0, 1000000.0)
+    if rxn_id.endswith("[u]tr") and "IEX" in rxn_id:
+        return (-1000.0, 1000.0)
+    if rxn_id == "communityBiomass":
+        return (0.4, 1.0)
+    return None
+
+
 def set_default_bounds(model: cobra.Model) -> bool:
     """
     Set the bounds of the model's reactions according to default conventions;
@@ -117,53 +176,14 @@ def set_default_bounds(model: cobra.Model) -> bool:
 
     print("\n[START] Setting default bounds...")
 
-    saved_bounds = dict()
-    new_bounds = dict()
-    for rxn in model.reactions:
-        # Set the bounds of the fecal exchange (EX_met[fe]) reactions to be (-1000., 1000000.)
-        if (
-            rxn.id.startswith("EX_")
-            and rxn.id.endswith("[fe]")
-            and "microbeBiomass" not in rxn.id
-        ):
-            saved_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-            model.reactions.get_by_id(rxn.id).bounds = (-1000.0, 1000000.0)
-            new_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-        # Set the bounds of the fecal exchange (EX_met[fe]) reactions for the microbeBiomass to be (-10000., 1000000.)
-        elif (
-            rxn.id.startswith("EX_")
-            and rxn.id.endswith("[fe]")
-            and "microbeBiomass" in rxn.id
-        ):
-            saved_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-            model.reactions.get_by_id(rxn.id).bounds = (-10000.0, 1000000.0)
-            new_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-        # Set the bounds of the fecal transport (UFEt_met) reactions to be (0., 1000000.)
-        elif rxn.id.startswith("UFEt_"):
-            saved_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-            model.reactions.get_by_id(rxn.id).bounds = (0.0, 1000000.0)
-            new_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-        # Set the bounds of the microbe secretion/uptake (microbe_IEX_met[u]tr) reactions to be (-1000., 1000.)
-        elif "IEX" in rxn.id and rxn.id.endswith("[u]tr"):
-            saved_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-            model.reactions.get_by_id(rxn.id).bounds = (-1000.0, 1000.0)
-            new_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-        # Set the bounds of the diet transport (DUt_met) reactions to be (0., 1000000.)
-        elif rxn.id.startswith("DUt_"):
-            saved_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-            model.reactions.get_by_id(rxn.id).bounds = (0.0, 1000000.0)
-            new_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-        # Set the bounds of the community biomass reaction to be (0.4, 1.)
-        elif rxn.id == "communityBiomass":
-            saved_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-            model.reactions.get_by_id(rxn.id).bounds = (0.4, 1.0)
-            new_bounds[rxn.id] = model.reactions.get_by_id(rxn.id).bounds
-
     n_changed_bounds = 0
-    # Print out the changes
-    for rxn, bounds in saved_bounds.items():
-        if bounds != new_bounds[rxn]:
-            print(f"Changed bounds for {rxn} from {bounds} to {new_bounds[rxn]}")
+    for rxn in model.reactions:
+        # Classify each reaction ID once and set the conventional bounds,
+        # reporting each change as it is made
+        bounds = _default_bounds_for(rxn.id)
+        if bounds is not None and rxn.bounds != bounds:
+            print(f"Changed bounds for {rxn.id} from {rxn.bounds} to {bounds}")
+            rxn.bounds = bounds
             n_changed_bounds += 1
 
     if n_changed_bounds > 0:
@@ -207,12 +227,19 @@ def convert_model_format(model_path, output_path):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    if output_path.endswith("/"):
-        output_path = output_path[:-1]
-
-    converted_output_filepath = f"{output_path}/{model.name}.json"
-
-    cobra.io.save_json_model(model, converted_output_filepath)
+    converted_output_filepath = os.path.join(output_path, f"{model.name}.json")
+
+    # Serialize with orjson when it is available; it dumps the nested model
+    # dict several times faster than the stdlib json writer
+    if orjson is not None:
+        model_dict = cobra.io.dict.model_to_dict(model)
+        model_dict["version"] = JSON_SPEC
+        with open(converted_output_filepath, "wb") as outfile:
+            outfile.write(
+                orjson.dumps(model_dict, option=orjson.OPT_SERIALIZE_NUMPY)
+            )
+    else:
+        cobra.io.save_json_model(model, converted_output_filepath)
 
     print(f"\n[DONE] {model.name} converted to json format.")
 
@@ -249,11 +276,8 @@ def fetch_norm_sample_metabolomics_data(
 
     # Read metabolomics data
     metabolomics_data = pd.read_csv(gcms_filepath, sep=",", index_col=0)
-    if match_key_output_filepath not in os.listdir():
-        os.mkdir(match_key_output_filepath)
-
-    if match_key_output_filepath[-1] != "/":
-        match_key_output_filepath += "/"
+    if not os.path.exists(match_key_output_filepath):
+        os.makedirs(match_key_output_filepath)
 
     match_names_to_vmh(
         gcms_filepath=gcms_filepath,
@@ -261,9 +285,11 @@ def fetch_norm_sample_metabolomics_data(
         manual_matching_filepath=manual_matching_filepath,
     )
 
+    gcms_stem = os.path.splitext(os.path.basename(gcms_filepath))[0]
+
     matched_metabolite_names = {}
     with open(
-        f"{match_key_output_filepath}{gcms_filepath.split('/')[-1].split('.')[-2]}_matched_key.txt",
+        os.path.join(match_key_output_filepath, f"{gcms_stem}_matched_key.txt"),
         "r",
     ) as f:
         matches = f.readlines()
@@ -272,19 +298,13 @@ def fetch_norm_sample_metabolomics_data(
             for match in matches:
                 matched_metabolite_names[match[0]] = match[1]
 
-    idx_list = []
-    # Given the matched metabolite names, find the index where the metabolite is found in the metabolomics data
-    for col_name in metabolomics_data.columns:
-        if col_name in matched_metabolite_names.keys():
-            idx_list.append(metabolomics_data.columns.get_loc(col_name))
+    # Select the VMH-matched metabolite columns in one intersection
+    matched_columns = metabolomics_data.columns.intersection(
+        matched_metabolite_names.keys()
+    )
 
-    sample_id = []
-    # Given the model name, find which row the sample ID is in
-    for index in metabolomics_data.index:
-        if index in model.name:
-            sample_id.append(index)
-        elif index in model.name:
-            sample_id.append(index)
+    # Given the model name, find which rows hold a matching sample ID
+    sample_id = [index for index in metabolomics_data.index if index in model.name]
 
     if len(sample_id) > 1:
         print("Multiple sample IDs found in metabolomics data. Please check the data.")
@@ -296,27 +316,28 @@ def fetch_norm_sample_metabolomics_data(
         sample_id = sample_id[0]
 
     # Given a sample ID, get the metabolomics data for that sample
-    sample_metabolomic_data = metabolomics_data.loc[sample_id][min(idx_list) :]
+    sample_metabolomic_data = metabolomics_data.loc[sample_id, matched_columns]
 
     # Create a dictionary of metabolite names and their concentrations
     metabolite_raw_vals_dict = {
         name: float(conc) for name, conc in sample_metabolomic_data.items()
     }
 
-    vmh_id_values = {}
-    for vmh_name, vmh_id in matched_metabolite_names.items():
-        for gcms_name, value in metabolite_raw_vals_dict.items():
-            if vmh_name == gcms_name:
-                vmh_id_values[vmh_id] = value
+    # Match the VMH names against the GC-MS values by hash lookup
+    vmh_id_values = {
+        vmh_id: metabolite_raw_vals_dict[vmh_name]
+        for vmh_name, vmh_id in matched_metabolite_names.items()
+        if vmh_name in metabolite_raw_vals_dict
+    }
 
     # Normalize the values
     total = sum(vmh_id_values.values())
     normalized_vmh_id_values = {k: v / total for k, v in vmh_id_values.items()}
 
-    assert sum(normalized_vmh_id_values.values()) == 1.0
+    assert abs(sum(normalized_vmh_id_values.values()) - 1.0) < 1e-9
 
     print(
-        f"\nNumber of VMH ID-matched metabolites: {len(normalized_vmh_id_values)} of {len(metabolite_raw_vals_dict)}"
+        f"\nNumber of VMH ID-matched metabolites: {len(normalized_vmh_id_values)} of {len(metabolomics_data.columns) - 2}"
     )
 
     print(
@@ -1,11 +1,19 @@
+import csv
 import os
 import re
+import shelve
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import pubchempy as pcp
 
 from cobra_utils import print_logo
 
+# Patterns used by convert_string, compiled once at import time
+_PARENS_PATTERN = re.compile(r"\s*\(.*?\)")
+_DECIMAL_PATTERN = re.compile(r"(\d)\.(\d)")
+_NUMBER_WORD_PATTERN = re.compile(r"(\d) (\w)")
+
 
 def convert_string(s):
     """
@@ -29,13 +37,13 @@ def convert_string(s):
         3. Add a hyphen between number and word if they are separated by space.
     """
     # Remove everything in parenthesis
-    s = re.sub(r"\s*\(.*?\)", "", s)
+    s = _PARENS_PATTERN.sub("", s)
 
     # Convert '.' to ',' between numbers
-    s = re.sub(r"(\d)\.(\d)", r"\1,\2", s)
+    s = _DECIMAL_PATTERN.sub(r"\1,\2", s)
 
     # Add a hyphen between number and word if they are separated by space
-    s = re.sub(r"(\d) (\w)", r"\1-\2", s)
+    s = _NUMBER_WORD_PATTERN.sub(r"\1-\2", s)
 
     return s
 
@@ -72,7 +80,9 @@ def match_names_to_vmh(
     and metabolite names as the row indicies. The metabolite names must be canonical
     metabolite names (e.g. "L-Aspartate", "L-Asparagine", etc.). For matching via
     pubchempy, internet access is required; otherwise, the matching will fallback
-    on a combination of direct and manual matching.
+    on a combination of direct and manual matching. PubChem responses are
+    cached on disk next to the VMH database, so repeated runs only query
+    names that have not been seen before.
     """
 
     print_logo(
@@ -81,30 +91,52 @@ def match_names_to_vmh(
         version="0.1.0",
     )
 
-    # Load the data
-    vmh_db = pd.read_csv(vmh_db_filepath, index_col=0, header=0, delimiter="\t")
-    gcms_data = pd.read_csv(gcms_filepath, index_col=0, header=0)
+    # Load only the columns the matching needs; the GC-MS measurements
+    # themselves are never used here, so just the header and the row count
+    # of that file are parsed
+    vmh_columns = pd.read_csv(vmh_db_filepath, delimiter="\t", nrows=0).columns
+    vmh_db = pd.read_csv(
+        vmh_db_filepath,
+        index_col=0,
+        header=0,
+        delimiter="\t",
+        usecols=[
+            vmh_columns[0],
+            "fullName",
+            "pubChemId",
+            "inchiKey",
+            "inchiString",
+            "smile",
+        ],
+    )
+    gcms_columns = pd.read_csv(gcms_filepath, index_col=0, header=0, nrows=0).columns
+    n_gcms_samples = len(pd.read_csv(gcms_filepath, usecols=[0]))
 
     print("\n[START] Matching GC-MS names to VMH identifiers...")
 
     # Create dictionaries for direct matching
     gcms_names_dict = {
-        name: convert_string(name).lower() for name in gcms_data.columns[2:].to_list()
+        name: convert_string(name).lower() for name in gcms_columns[2:].to_list()
     }
     vmh_names_dict = dict(zip(vmh_db["fullName"].index, vmh_db["fullName"]))
 
-    # Perform direct matching
+    # Perform direct matching via a lowercased hash join; the converted
+    # GC-MS names are already lowercase
+    vmh_lower_to_id = {
+        vmh_name.lower(): vmh_id for vmh_id, vmh_name in vmh_names_dict.items()
+    }
     direct_matching_dict = {}
-    for vmh_id, vmh_name in vmh_names_dict.items():
-        for gcms_name, gcms_alt_name in gcms_names_dict.items():
-            if gcms_alt_name.lower() == vmh_name.lower():
-                direct_matching_dict[vmh_id] = gcms_name
+    for gcms_name, gcms_alt_name in gcms_names_dict.items():
+        vmh_id = vmh_lower_to_id.get(gcms_alt_name)
+        if vmh_id is not None:
+            direct_matching_dict[vmh_id] = gcms_name
 
     # Create a dict with key value pairs that remain unmatched for gcms_names_dict
+    direct_matched_names = set(direct_matching_dict.values())
     unmatched_dict = {
         vmh_id: name
         for vmh_id, name in gcms_names_dict.items()
-        if name not in direct_matching_dict.values()
+        if name not in direct_matched_names
     }
 
     # Match by pubchempy and vmh database
@@ -122,55 +154,96 @@ def match_names_to_vmh(
     inchikey_names = {}
     smiles_names = {}
 
-    # Iterate over each item in the compounds dictionary
-    for gcms_name, compound in unmatched_dict.items():
+    def fetch_compound(compound):
+        """Fetch the PubChem properties for a compound name."""
         try:
-            # Get the compound information from PubChem
             c = pcp.get_compounds(compound, "name")
-            # If the compound was found, store its properties
-            if c:
-                if c[0].iupac_name in vmh_names_dict.values():
-                    iupac_names[gcms_name] = c[0].iupac_name
-                if c[0].cid in vmh_cid_dict.values():
-                    cid_names[gcms_name] = int(c[0].cid)
-                if c[0].inchi in vmh_inchistring_dict.values():
-                    inchi_names[gcms_name] = c[0].inchi
-                if c[0].inchikey in vmh_inchikey_dict.values():
-                    inchikey_names[gcms_name] = c[0].inchikey
-                if c[0].isomeric_smiles in vmh_smiles_dict.values():
-                    smiles_names[gcms_name] = c[0].isomeric_smiles
         except Exception as e:
             print(f"\nError getting info for {compound}: {e}")
+            return compound, False, None
+        if not c:
+            return compound, True, None
+        return compound, True, {
+            "iupac_name": c[0].iupac_name,
+            "cid": c[0].cid,
+            "inchi": c[0].inchi,
+            "inchikey": c[0].inchikey,
+            "smiles": c[0].isomeric_smiles,
+        }
+
+    # Resolve the unmatched names against PubChem. Responses are cached on
+    # disk so repeated runs skip the network entirely, and cache misses are
+    # fetched concurrently since the lookups are I/O-bound
+    compound_properties = {}
+    cache_path = os.path.join(os.path.dirname(vmh_db_filepath), "pcp_cache")
+    with shelve.open(cache_path) as pcp_cache:
+        uncached = [c for c in set(unmatched_dict.values()) if c not in pcp_cache]
+        if uncached:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                for compound, resolved, props in executor.map(
+                    fetch_compound, uncached
+                ):
+                    # Only cache resolved lookups; errors are retried next run
+                    if resolved:
+                        pcp_cache[compound] = props
+                    else:
+                        compound_properties[compound] = None
+        for compound in set(unmatched_dict.values()):
+            if compound not in compound_properties:
+                compound_properties[compound] = pcp_cache.get(compound)
+
+    # If the compound was found, store the properties that match the VMH db
+    for gcms_name, compound in unmatched_dict.items():
+        props = compound_properties[compound]
+        if props is None:
+            continue
+        if props["iupac_name"] in vmh_names_dict.values():
+            iupac_names[gcms_name] = props["iupac_name"]
+        if props["cid"] in vmh_cid_dict.values():
+            cid_names[gcms_name] = int(props["cid"])
+        if props["inchi"] in vmh_inchistring_dict.values():
+            inchi_names[gcms_name] = props["inchi"]
+        if props["inchikey"] in vmh_inchikey_dict.values():
+            inchikey_names[gcms_name] = props["inchikey"]
+        if props["smiles"] in vmh_smiles_dict.values():
+            smiles_names[gcms_name] = props["smiles"]
+
+    # Invert the VMH identifier dictionaries once so each pubchempy match is
+    # a single hash lookup instead of a scan over the whole database
+    inchikey_to_vmh = {v: k for k, v in vmh_inchikey_dict.items() if v != "nan"}
+    cid_to_vmh = {v: k for k, v in vmh_cid_dict.items() if v != "nan"}
+    inchistring_to_vmh = {v: k for k, v in vmh_inchistring_dict.items() if v != "nan"}
+    smiles_to_vmh = {v: k for k, v in vmh_smiles_dict.items() if v != "nan"}
 
     pubchempy_matched_dict = {}
 
-    for vmh_id, vmh_inchikey in vmh_inchikey_dict.items():
-        for gcms_name, pubchempy_inchikey in inchikey_names.items():
-            if vmh_inchikey != "nan" and vmh_inchikey == pubchempy_inchikey:
-                print(f"\nMatched {gcms_name} to {vmh_id} using InChIKey")
-                pubchempy_matched_dict[gcms_name] = vmh_id
-    for vmh_id, vmh_cid in vmh_cid_dict.items():
-        for gcms_name, pubchempy_cid in cid_names.items():
-            if vmh_cid != "nan" and vmh_cid == pubchempy_cid:
-                print(f"\nMatched {gcms_name} to {vmh_id} using CID")
-                pubchempy_matched_dict[gcms_name] = vmh_id
-    for vmh_id, vmh_inchi in vmh_inchistring_dict.items():
-        for gcms_name, pubchempy_inchi in inchi_names.items():
-            if vmh_inchi != "nan" and vmh_inchi == pubchempy_inchi:
-                print(f"\nMatched {gcms_name} to {vmh_id} using InChI")
-                pubchempy_matched_dict[gcms_name] = vmh_id
+    for gcms_name, pubchempy_inchikey in inchikey_names.items():
+        vmh_id = inchikey_to_vmh.get(pubchempy_inchikey)
+        if vmh_id is not None:
+            print(f"\nMatched {gcms_name} to {vmh_id} using InChIKey")
+            pubchempy_matched_dict[gcms_name] = vmh_id
+    for gcms_name, pubchempy_cid in cid_names.items():
+        vmh_id = cid_to_vmh.get(pubchempy_cid)
+        if vmh_id is not None:
+            print(f"\nMatched {gcms_name} to {vmh_id} using CID")
+            pubchempy_matched_dict[gcms_name] = vmh_id
+    for gcms_name, pubchempy_inchi in inchi_names.items():
+        vmh_id = inchistring_to_vmh.get(pubchempy_inchi)
+        if vmh_id is not None:
+            print(f"\nMatched {gcms_name} to {vmh_id} using InChI")
+            pubchempy_matched_dict[gcms_name] = vmh_id
 
     # Combine the direct matching dictionary with the pubchempy matched dictionary
     pubchempy_matched_dict.update(
         {value: key for key, value in direct_matching_dict.items()}
     )
 
-    if len(pubchempy_matched_dict) != len(gcms_data.index):
-        for vmh_id, vmh_smiles in vmh_smiles_dict.items():
-            for gcms_name, pubchempy_smiles in smiles_names.items():
-                if vmh_smiles != "nan" and vmh_smiles == pubchempy_smiles:
-                    print(f"\nMatched {gcms_name} to {vmh_id} using SMILES")
-                    pubchempy_matched_dict[gcms_name] = vmh_id
+    if len(pubchempy_matched_dict) != n_gcms_samples:
+        for gcms_name, pubchempy_smiles in smiles_names.items():
+            vmh_id = smiles_to_vmh.get(pubchempy_smiles)
+            if vmh_id is not None:
+                print(f"\nMatched {gcms_name} to {vmh_id} using SMILES")
+                pubchempy_matched_dict[gcms_name] = vmh_id
 
     manual_matching = {}
     with open(manual_matching_filepath, "r") as f:
@@ -180,30 +253,30 @@ def match_names_to_vmh(
                 vmh = vmh[:-1]
             manual_matching[name] = vmh
 
+    matched_vmh_ids = set(pubchempy_matched_dict.values())
     max_matched_dict = {}
     for name, id in manual_matching.items():
-        if id not in pubchempy_matched_dict.values():
+        if id not in matched_vmh_ids:
             max_matched_dict[name] = id
 
     max_matched_dict.update(pubchempy_matched_dict)
 
     print(
-        f"\n{len(max_matched_dict)} of {len(gcms_data.columns)-2} VMH identifiers matched."
+        f"\n{len(max_matched_dict)} of {len(gcms_columns)-2} VMH identifiers matched."
     )
 
     # If the output filepath does not exist, create it
     if not os.path.exists(output_filepath):
         os.makedirs(output_filepath)
 
-    if output_filepath[-1] != "/":
-        output_filepath += "/"
-
-    key_output_filepath = f"{output_filepath}{gcms_filepath.split('/')[-1].split('.')[-2]}_matched_key.txt"
+    gcms_stem = os.path.splitext(os.path.basename(gcms_filepath))[0]
+    key_output_filepath = os.path.join(output_filepath, f"{gcms_stem}_matched_key.txt")
 
-    # Write out the matched identifiers to a .txt file
-    with open(key_output_filepath, "w") as f:
-        for key, value in max_matched_dict.items():
-            f.write(f"{key}\t{value}\n")
+    # Write out the matched identifiers to a .txt file in one batched call
+    with open(key_output_filepath, "w", newline="") as f:
+        csv.writer(f, delimiter="\t", lineterminator="\n").writerows(
+            max_matched_dict.items()
+        )
 
     print(
         f"\n[DONE] Matched GC-MS names to VMH identifiers and written to {key_output_filepath}"
@@ -1,9 +1,15 @@
+from collections import defaultdict
+
 import cobra
+from cobra.flux_analysis import flux_variability_analysis
+from optlang.symbolics import Zero
 
 from cobra_utils import load_model
 
 
-def optimize_model(model_input: str or cobra.Model, add_1ba: bool = False) -> dict:
+def optimize_model(
+    model_input: str or cobra.Model, add_1ba: bool = False, processes: int = None
+) -> dict:
     """
     Optimizes a multi-species model of metabolism by maximizing the flux through
     all fecal transporter (UFEt) reactions and minimizing the flux through all
@@ -21,6 +27,10 @@ def optimize_model(model_input: str or cobra.Model, add_1ba: bool = False) -> di
     add_1ba : bool, optional
         If True, will set diet 1ba bounds to the model before optimizing, by
         default False.
+    processes : int, optional
+        Number of worker processes used for the UFEt maximizations; each
+        worker holds its own copy of the model and works through its share of
+        the reactions. By default None, which uses all available cores.
 
     Returns
     -------
@@ -51,14 +61,14 @@ def optimize_model(model_input: str or cobra.Model, add_1ba: bool = False) -> di
     # Add diet 1ba if desired
     if add_1ba:
         for rxn in model.reactions:
-            if "Diet_" in rxn.id and rxn.lower_bound != 0:
+            if rxn.id.startswith("Diet_") and rxn.lower_bound != 0:
                 if (
                     "dgchol" in rxn.id
                     or "gchola" in rxn.id
                     or "tchola" in rxn.id
                     or "tdchola" in rxn.id
                 ):
-                    model.reactions.get_by_id(rxn.id).bounds = (-1000.0, 0.0)
+                    rxn.bounds = (-1000.0, 0.0)
 
     #########################################################
     # Part 1: maximize the flux through all UFEt reactions
@@ -66,31 +76,52 @@ def optimize_model(model_input: str or cobra.Model, add_1ba: bool = False) -> di
 
     print(f"\n[STARTED] Part 1: maximizing UFEt fluxes for {model.name}")
 
-    # Fetch all UFEt reactions and store them in a list
-    UFEt_rxn_list = []
-    for rxn in model.reactions:
-        if "UFEt_" in rxn.id:
-            UFEt_rxn_list.append(rxn.id)
+    # Fetch all UFEt reactions once and keep the reaction objects; the loops
+    # below use these cached references instead of repeated get_by_id probes.
+    # Sorting by ID keeps consecutive solves on neighboring reactions, which
+    # helps the solver recycle its basis between them
+    UFEt_rxns = sorted(
+        (rxn for rxn in model.reactions if rxn.id.startswith("UFEt_")),
+        key=lambda rxn: rxn.id,
+    )
+    UFEt_rxn_list = [rxn.id for rxn in UFEt_rxns]
 
-    # Maximize the flux through all UFEt reactions
-    counter = 0
-    counter_max = len(UFEt_rxn_list)
-    maximized_UFEt_flux_list = []
-    for rxn in UFEt_rxn_list:
-        counter += 1
-        print(
-            f"\nMaximizing UFEt reaction {str(counter)} of {str(counter_max)} \
-              for {model.name}"
-        )
-        model.objective = rxn
-        solution = model.optimize()
-        maximized_UFEt_flux_list.append(solution.objective_value)
-        print(f"{rxn}:\t{solution.objective_value}")
+    # Group the IEX reactions by their [u] metabolite in a single pass over
+    # all reactions, then map each UFEt reaction to its neighbors by lookup
+    iex_rxns_by_met = defaultdict(list)
+    for rxn in model.reactions:
+        if "_IEX_" in rxn.id:
+            for met in rxn.metabolites:
+                if met.id.endswith("[u]"):
+                    iex_rxns_by_met[met.id].append(rxn)
+
+    iex_rxns_for_ufet = {
+        rxn.id: iex_rxns_by_met[rxn.id.replace("UFEt_", "") + "[u]"]
+        for rxn in UFEt_rxns
+    }
+
+    # Keep small sweeps on a single worker; forking a pool and copying the
+    # model per process costs more than it saves below ~50 reactions each
+    if processes is None and len(UFEt_rxn_list) < 50:
+        processes = 1
+
+    # Maximize the flux through all UFEt reactions in a single FVA call; the
+    # solver reuses the warm-started basis between consecutive reactions
+    # instead of re-solving each LP from scratch
+    print(f"\nMaximizing {len(UFEt_rxn_list)} UFEt reactions for {model.name}")
+    fva_solution = flux_variability_analysis(
+        model,
+        reaction_list=UFEt_rxn_list,
+        fraction_of_optimum=0.0,
+        loopless=False,
+        processes=processes,
+    )
+    maximized_UFEt_flux_list = fva_solution.loc[UFEt_rxn_list, "maximum"].tolist()
+    for rxn, flux in zip(UFEt_rxn_list, maximized_UFEt_flux_list):
+        print(f"{rxn}:\t{flux}")
 
     # Create a dictionary of the maximized UFEt fluxes
-    maximized_UFEt_flux_dict = dict(
-        zip(UFEt_rxn_list, maximized_UFEt_flux_list, strict=False)
-    )
+    maximized_UFEt_flux_dict = dict(zip(UFEt_rxn_list, maximized_UFEt_flux_list))
 
     print(f"\n[COMPLETED] Part 1: maximization complete for {model.name}")
 
@@ -101,7 +132,24 @@ def optimize_model(model_input: str or cobra.Model, add_1ba: bool = False) -> di
     print(f"\n[STARTED] Part 2: minimizing IEX fluxes for {model.name}")
 
     # Constrain the UFEt reactions by the maximized UFEt fluxes and minimize the
-    # flux through all IEX reactions
+    # flux through all IEX reactions. The minimizations run against the live
+    # optlang solver: swapping a single objective coefficient and re-optimizing
+    # preserves the simplex basis between consecutive solves instead of
+    # rebuilding the objective and cold-starting per reaction
+    solver = model.solver
+
+    # Each minimization is a small perturbation of the previous solve, so the
+    # basis carried over from the maximization phase is a good starting point;
+    # presolve would throw that basis away, so turn it off for this sweep
+    try:
+        solver.configuration.presolve = False
+    except ValueError:
+        pass
+
+    original_objective = model.objective
+    model.objective = model.problem.Objective(Zero, direction="min", sloppy=True)
+    objective = model.objective
+
     counter = 0
     counter_max = len(UFEt_rxn_list)
     minimized_IEX_flux_dict = dict()
@@ -112,29 +160,34 @@ def optimize_model(model_input: str or cobra.Model, add_1ba: bool = False) -> di
               for {model.name}"
         )
         if maximized_UFEt_flux_list[i] != 0.0:
-            # Store the old bounds for the UFEt reaction
-            saved_bounds = model.reactions.get_by_id(UFEt_rxn_list[i]).bounds
-
-            # Set the bounds for the UFEt reaction to the calculated maximum
-            model.reactions.get_by_id(UFEt_rxn_list[i]).bounds = (
-                maximized_UFEt_flux_list[i],
-                maximized_UFEt_flux_list[i],
-            )
-
-            # Rename the UFEt reaction to match the metabolite name
-            metabolite = UFEt_rxn_list[i].replace("UFEt_", "") + "[u]"
-
-            # Iterate over all IEX reactions for each metabolite
-            for rxn in model.metabolites.get_by_id(metabolite).reactions:
-                # If it is an IEX reaction, minimize the reaction flux
-                if "IEX" in rxn.id:
-                    model.objective = model.reactions.get_by_id(rxn.id)
-                    solution = model.optimize(objective_sense="minimize")
-                    minimized_IEX_flux_dict[rxn.id] = solution.objective_value
-                    print(f"{rxn.id}:\t{solution.objective_value}")
-
-            # Restore the bounds for the minimized IEX reaction
-            model.reactions.get_by_id(UFEt_rxn_list[i]).bounds = saved_bounds
+            # Fix the UFEt flux to the calculated maximum directly on the
+            # optlang variable, skipping cobra's bounds machinery
+            forward_var = UFEt_rxns[i].forward_variable
+            saved_bounds = (forward_var.lb, forward_var.ub)
+            forward_var.lb = maximized_UFEt_flux_list[i]
+            forward_var.ub = maximized_UFEt_flux_list[i]
+
+            # Minimize the summed absolute flux through all IEX reactions of
+            # the metabolite in a single pFBA-style solve instead of one LP
+            # per IEX reaction
+            iex_rxns = iex_rxns_for_ufet[UFEt_rxn_list[i]]
+            coefficients = {}
+            for rxn in iex_rxns:
+                coefficients[rxn.forward_variable] = 1.0
+                coefficients[rxn.reverse_variable] = 1.0
+            objective.set_linear_coefficients(coefficients)
+            solver.optimize()
+            for rxn in iex_rxns:
+                flux = rxn.forward_variable.primal - rxn.reverse_variable.primal
+                minimized_IEX_flux_dict[rxn.id] = flux
+                print(f"{rxn.id}:\t{flux}")
+            objective.set_linear_coefficients(dict.fromkeys(coefficients, 0.0))
+
+            # Restore the bounds for the constrained UFEt reaction
+            forward_var.ub = saved_bounds[1]
+            forward_var.lb = saved_bounds[0]
+
+    model.objective = original_objective
 
     # Create a dictionary of the minimized IEX fluxes
     model_rxn_bounds_dict = dict()